@@ -99,6 +99,19 @@ class ReportQueue(object):
                     self._delta_index_map[delta_key] = len(self._queue)
                     self._queue.append(msg)
 
+    def snapshot(self):
+        """Return a copy of this queue's messages, taken atomically.
+
+        Unlike iterating the queue directly, this is safe to call from a
+        thread other than the one that's enqueuing messages.
+
+        Returns
+        -------
+        list of ForwardMsg
+        """
+        with self._lock:
+            return list(self._queue)
+
     def clone(self):
         """Return the elements of this ReportQueue as a collections.deque."""
         r = ReportQueue()
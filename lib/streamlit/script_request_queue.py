@@ -76,52 +76,68 @@ class ScriptRequestQueue(object):
             Data associated with the request, if any. For example, could be of type RerunData.
         """
         with self._lock:
-            if request == ScriptRequest.SHUTDOWN:
-                # If we get a shutdown request, it jumps to the front of the
-                # queue to be processed immediately.
-                self._queue.appendleft((request, data))
-            elif request == ScriptRequest.RERUN:
-                index = _index_if(self._queue, lambda item: item[0] == request)
-                if index >= 0:
-                    _, old_data = self._queue[index]
-
-                    if old_data.widget_states is None:
-                        # The existing request's widget_states is None, which
-                        # means it wants to rerun with whatever the most
-                        # recent script execution's widget state was.
-                        # We have no meaningful state to merge with, and
-                        # so we simply overwrite the existing request.
-                        self._queue[index] = (
-                            request,
-                            RerunData(
-                                query_string=data.query_string,
-                                widget_states=data.widget_states,
-                            ),
-                        )
-                    elif data.widget_states is None:
-                        # If this request's widget_states is None, and the
-                        # existing request's widget_states was not, this
-                        # new request is entirely redundant and can be dropped.
-                        # TODO: Figure out if this should even happen. This sounds like it should
-                        # raise an exception...
-                        pass
-                    else:
-                        # Both the existing and the new request have
-                        # non-null widget_states. Merge them together.
-                        coalesced_states = coalesce_widget_states(
-                            old_data.widget_states, data.widget_states
-                        )
-                        self._queue[index] = (
-                            request,
-                            RerunData(
-                                query_string=data.query_string,
-                                widget_states=coalesced_states,
-                            ),
-                        )
+            self._enqueue(request, data)
+
+    def enqueue_many(self, requests):
+        """Enqueue multiple requests while holding the queue's lock once.
+
+        Each request may be coalesced with an existing request, exactly as
+        if it had been passed to `enqueue` - this is just a cheaper way to
+        publish a batch of requests, since the lock is acquired a single
+        time rather than once per request.
+
+        Parameters
+        ----------
+        requests : Iterable[Tuple[ScriptRequest, Any]]
+            The (request, data) pairs to enqueue, in order.
+        """
+        with self._lock:
+            for request, data in requests:
+                self._enqueue(request, data)
+
+    def _enqueue(self, request, data):
+        """Enqueue a single request. The caller must hold self._lock."""
+        if request == ScriptRequest.SHUTDOWN:
+            # If we get a shutdown request, it jumps to the front of the
+            # queue to be processed immediately.
+            self._queue.appendleft((request, data))
+        elif request == ScriptRequest.RERUN:
+            index = _index_if(self._queue, lambda item: item[0] == request)
+            if index >= 0:
+                _, old_data = self._queue[index]
+
+                if old_data.widget_states is None:
+                    # The existing request's widget_states is None, which
+                    # means it wants to rerun with whatever the most
+                    # recent script execution's widget state was.
+                    # We have no meaningful state to merge with, and
+                    # so we simply overwrite the existing request with the
+                    # new one as-is.
+                    self._queue[index] = (request, data)
+                elif data.widget_states is None:
+                    # If this request's widget_states is None, and the
+                    # existing request's widget_states was not, this
+                    # new request is entirely redundant and can be dropped.
+                    # TODO: Figure out if this should even happen. This sounds like it should
+                    # raise an exception...
+                    pass
                 else:
-                    self._queue.append((request, data))
+                    # Both the existing and the new request have
+                    # non-null widget_states. Merge them together.
+                    coalesced_states = coalesce_widget_states(
+                        old_data.widget_states, data.widget_states
+                    )
+                    self._queue[index] = (
+                        request,
+                        RerunData(
+                            query_string=data.query_string,
+                            widget_states=coalesced_states,
+                        ),
+                    )
             else:
                 self._queue.append((request, data))
+        else:
+            self._queue.append((request, data))
 
     def dequeue(self):
         """Pops the front-most request from the queue and returns it.
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
+import os
 import sys
 import threading
 import gc
@@ -27,6 +29,8 @@ from streamlit import util
 from streamlit.error_util import handle_uncaught_app_exception
 from streamlit.media_file_manager import media_file_manager
 from streamlit.report_thread import ReportThread, ReportContext
+from streamlit.report_thread import REPORT_CONTEXT_ATTR_NAME
+from streamlit.report_thread import add_report_ctx
 from streamlit.report_thread import get_report_ctx
 from streamlit.script_request_queue import ScriptRequest
 from streamlit.state.session_state import SessionState
@@ -127,21 +131,54 @@ class ScriptRunner(object):
         # maybe_handle_execution_control_request.
         self._execing = False
 
-        # This is initialized in start()
+        # These are initialized in start()
         self._script_thread = None
+        self._script_future = None
 
     def __repr__(self) -> str:
         return util.repr_(self)
 
-    def start(self):
+    def start(self, executor=None):
         """Start a new thread to process the ScriptEventQueue.
 
         This must be called only once.
 
+        Parameters
+        ----------
+        executor : concurrent.futures.Executor or None
+            If provided, the request queue is processed on one of the
+            executor's worker threads, rather than on a newly-spawned
+            thread. The worker thread has a ReportContext attached to it
+            for the duration of the run, and the resulting Future is
+            stored in self._script_future.
+
         """
-        if self._script_thread is not None:
+        if self._script_thread is not None or self._script_future is not None:
             raise Exception("ScriptRunner was already started")
 
+        if executor is not None:
+            ctx = ReportContext(
+                session_id=self._session_id,
+                enqueue=self._enqueue_forward_msg,
+                query_string=self._client_state.query_string,
+                session_state=self._session_state,
+                uploaded_file_mgr=self._uploaded_file_mgr,
+            )
+
+            def run_with_ctx():
+                # Attach our ReportContext to the worker thread for the
+                # duration of the run, and detach it afterwards so the
+                # pooled thread can be reused by another ScriptRunner.
+                thread = threading.current_thread()
+                self._script_thread = add_report_ctx(thread, ctx)
+                try:
+                    self._process_request_queue()
+                finally:
+                    delattr(thread, REPORT_CONTEXT_ATTR_NAME)
+
+            self._script_future = executor.submit(run_with_ctx)
+            return
+
         self._script_thread = ReportThread(
             session_id=self._session_id,
             enqueue=self._enqueue_forward_msg,
@@ -153,6 +190,40 @@ class ScriptRunner(object):
         )
         self._script_thread.start()
 
+    def run_inline(self):
+        """Process the ScriptEventQueue on the calling thread, returning
+        when the queue has been drained or a SHUTDOWN request is processed.
+
+        An alternative to start() for callers - primarily tests - that
+        don't need a separate script thread. A ReportContext is attached to
+        the calling thread for the duration of the run, and any previous
+        context is restored afterwards.
+
+        This must be called only once, and must not be combined with
+        start().
+        """
+        if self._script_thread is not None or self._script_future is not None:
+            raise Exception("ScriptRunner was already started")
+
+        thread = threading.current_thread()
+        prev_ctx = getattr(thread, REPORT_CONTEXT_ATTR_NAME, None)
+        ctx = ReportContext(
+            session_id=self._session_id,
+            enqueue=self._enqueue_forward_msg,
+            query_string=self._client_state.query_string,
+            session_state=self._session_state,
+            uploaded_file_mgr=self._uploaded_file_mgr,
+        )
+        self._script_thread = add_report_ctx(thread, ctx)
+        try:
+            self._process_request_queue()
+        finally:
+            self._script_thread = None
+            if prev_ctx is not None:
+                setattr(thread, REPORT_CONTEXT_ATTR_NAME, prev_ctx)
+            else:
+                delattr(thread, REPORT_CONTEXT_ATTR_NAME)
+
     def _process_request_queue(self):
         """Process the ScriptRequestQueue and then exits.
 
@@ -276,24 +347,12 @@ class ScriptRunner(object):
         # in their previous report disappearing.
 
         try:
-            with source_util.open_python_file(self._report.script_path) as f:
-                filebody = f.read()
-
-            if config.get_option("runner.magicEnabled"):
-                filebody = magic.add_magic(filebody, self._report.script_path)
-
-            code = compile(
-                filebody,
-                # Pass in the file path so it can show up in exceptions.
+            code = _compile_script(
                 self._report.script_path,
-                # We're compiling entire blocks of Python, so we need "exec"
-                # mode (as opposed to "eval" or "single").
-                mode="exec",
-                # Don't inherit any flags or "future" statements.
-                flags=0,
-                dont_inherit=1,
-                # Use the default optimization options.
-                optimize=-1,
+                # Include the file's mtime in the memoization key, so that
+                # edits to the script invalidate its cached code object.
+                os.path.getmtime(self._report.script_path),
+                config.get_option("runner.magicEnabled"),
             )
 
         except BaseException as e:
@@ -418,6 +477,52 @@ class RerunException(ScriptControlException):
         return util.repr_(self)
 
 
+@functools.lru_cache(maxsize=32)
+def _compile_script(script_path, mtime, magic_enabled):
+    """Compile the script at the given path and return its code object.
+
+    Results are memoized on (script_path, mtime, magic_enabled), so that
+    rerunning an unchanged script reuses the already-compiled code object
+    instead of re-reading and re-parsing the file on every run. Compile
+    errors are not cached; they're re-raised on each call.
+
+    Parameters
+    ----------
+    script_path : str
+        The path of the script to compile.
+    mtime : float
+        The script file's modification time, as returned by
+        os.path.getmtime(). Edits to the script change its mtime and
+        therefore invalidate its cache entry.
+    magic_enabled : bool
+        The value of the "runner.magicEnabled" config option.
+
+    Returns
+    -------
+    The compiled code object.
+
+    """
+    with source_util.open_python_file(script_path) as f:
+        filebody = f.read()
+
+    if magic_enabled:
+        filebody = magic.add_magic(filebody, script_path)
+
+    return compile(
+        filebody,
+        # Pass in the file path so it can show up in exceptions.
+        script_path,
+        # We're compiling entire blocks of Python, so we need "exec"
+        # mode (as opposed to "eval" or "single").
+        mode="exec",
+        # Don't inherit any flags or "future" statements.
+        flags=0,
+        dont_inherit=1,
+        # Use the default optimization options.
+        optimize=-1,
+    )
+
+
 def _clean_problem_modules():
     """Some modules are stateful, so we have to clear their state."""
 
@@ -69,6 +69,20 @@ class ScriptRequestQueueTest(unittest.TestCase):
         thread.join(timeout=0.25)
         self.assertFalse(thread.is_alive())
 
+    def test_enqueue_many(self):
+        """Test that enqueue_many coalesces requests the same way that
+        consecutive enqueue calls do."""
+        queue = ScriptRequestQueue()
+
+        queue.enqueue_many(
+            [(ScriptRequest.RERUN, RerunData(widget_states=None))] * 3
+        )
+
+        # The three RERUN requests should have been coalesced into one.
+        event, data = queue.dequeue()
+        self.assertEqual(event, ScriptRequest.RERUN)
+        self.assertEqual((None, None), queue.dequeue(), "Expected empty event queue")
+
     def test_rerun_data_coalescing(self):
         """Test that multiple RERUN requests get coalesced with
         expected values.
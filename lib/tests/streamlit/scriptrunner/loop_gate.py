@@ -0,0 +1,25 @@
+# Copyright 2018-2021 Streamlit Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A shared gate for ScriptRunnerTest's looping test scripts.
+
+test_data/gated_loop.py loops until this Event is set. Tests that run it
+should clear() the gate in setUp and set() it in tearDown, so that a script
+left running by a failed test exits promptly instead of looping until its
+ScriptRunner is garbage collected.
+"""
+
+import threading
+
+loop_gate = threading.Event()
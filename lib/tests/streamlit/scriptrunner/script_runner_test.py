@@ -16,12 +16,14 @@
 
 import os
 import sys
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from unittest.mock import patch
 
-from parameterized import parameterized
-from tornado.testing import AsyncTestCase
+import pytest
 
 from streamlit import caching
 from streamlit.error_util import _GENERIC_UNCAUGHT_EXCEPTION_TEXT
@@ -36,11 +38,80 @@ from streamlit.script_request_queue import RerunData, ScriptRequest, ScriptReque
 from streamlit.script_runner import ScriptRunner, ScriptRunnerEvent
 from streamlit.state.session_state import SessionState
 from tests import testutil
+from tests.streamlit.scriptrunner.loop_gate import loop_gate
+
+# Where the test scripts live. Computed once at import time rather than on
+# every TestScriptRunner construction.
+_TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "test_data")
 
 text_utf = "complete! 👨‍🎤"
 text_no_encoding = text_utf
 text_latin = "complete! ð\x9f\x91¨â\x80\x8dð\x9f\x8e¤"
 
+# The event sequences emitted by a single successful script run and by a
+# run that fails to compile.
+_SUCCESS_EVENTS = [
+    ScriptRunnerEvent.SCRIPT_STARTED,
+    ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+    ScriptRunnerEvent.SHUTDOWN,
+]
+_COMPILE_ERROR_EVENTS = [
+    ScriptRunnerEvent.SCRIPT_STARTED,
+    ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR,
+    ScriptRunnerEvent.SHUTDOWN,
+]
+
+
+# TestScriptRunners that have been created but not yet close()d.
+# The cleanup_runners fixture closes (and removes) them all.
+_live_runners: List["TestScriptRunner"] = []
+
+# Serialized WidgetStates that updates all of widgets_script.py's widgets.
+# Built lazily by _get_updated_widget_states and shared by the tests that
+# rerun the script with new widget values.
+_updated_widget_states_blob = None
+
+
+@pytest.fixture(scope="module", autouse=True)
+def forward_script_thread_exceptions():
+    """Forward uncaught script-thread exceptions to the TestScriptRunner
+    that owns the thread, so tests can assert on them without paying for a
+    try/except wrapper on every request-queue run."""
+    prev_excepthook = threading.excepthook
+
+    def script_thread_excepthook(args):
+        for runner in list(_live_runners):
+            if runner._script_thread is args.thread:
+                runner.script_thread_exceptions.append(args.exc_value)
+                return
+        prev_excepthook(args)
+
+    threading.excepthook = script_thread_excepthook
+    yield
+    threading.excepthook = prev_excepthook
+
+
+@pytest.fixture(scope="module")
+def executor():
+    """A shared thread pool for tests that run several ScriptRunners at
+    once, so thread startup cost is paid once for the whole module."""
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+@pytest.fixture(autouse=True)
+def cleanup_runners():
+    loop_gate.clear()
+    yield
+    # Release any gated_loop.py script that's still running, so a failed
+    # test doesn't leave a looping script thread behind.
+    loop_gate.set()
+    # Close any runners the test created, dropping their event listeners
+    # and queued messages.
+    for runner in list(_live_runners):
+        runner.close()
+
 
 def _create_widget(id, states):
     """
@@ -53,91 +124,25 @@ def _create_widget(id, states):
     return states.widgets[-1]
 
 
-class ScriptRunnerTest(AsyncTestCase):
-    def setUp(self):
-        super(ScriptRunnerTest, self).setUp()
-
-    def tearDown(self):
-        super(ScriptRunnerTest, self).tearDown()
-
-    def test_startup_shutdown(self):
-        """Test that we can create and shut down a ScriptRunner."""
-        scriptrunner = TestScriptRunner("good_script.py")
-        scriptrunner.start()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(scriptrunner, [ScriptRunnerEvent.SHUTDOWN])
-        self._assert_text_deltas(scriptrunner, [])
-
-    @parameterized.expand(
-        [
-            ("good_script.py", text_utf),
-            # These files are .txt to avoid being broken by "make headers".
-            ("good_script_no_encoding.py.txt", text_no_encoding),
-            ("good_script_latin_encoding.py.txt", text_latin),
-        ]
-    )
-    def test_run_script(self, filename, text):
-        """Tests that we can run a script to completion."""
-        scriptrunner = TestScriptRunner(filename)
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
-        self._assert_text_deltas(scriptrunner, [text])
-        # The following check is a requirement for the CodeHasher to
-        # work correctly. The CodeHasher is scoped to
-        # files contained in the directory of __main__.__file__, which we
-        # assume is the main script directory.
-        self.assertEqual(
-            scriptrunner._report.script_path,
-            sys.modules["__main__"].__file__,
-            (" ScriptRunner should set the __main__.__file__" "attribute correctly"),
-        )
-
-    def test_compile_error(self):
-        """Tests that we get an exception event when a script can't compile."""
-        scriptrunner = TestScriptRunner("compile_error.py.txt")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
-        self._assert_text_deltas(scriptrunner, [])
-
-    @patch("streamlit.state.session_state.SessionState.call_callbacks")
-    def test_calls_widget_callbacks(self, patched_call_callbacks):
-        scriptrunner = TestScriptRunner("widgets_script.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
+def _get_updated_widget_states(scriptrunner):
+    """Return a WidgetStates proto that updates all four of
+    widgets_script.py's widgets.
 
-        # Default widget values
-        require_widgets_deltas([scriptrunner])
-        self._assert_text_deltas(
-            scriptrunner, ["False", "ahoy!", "0", "False", "loop_forever"]
-        )
+    The proto is built once, using widget ids from the given runner's
+    deltas, and cached in serialized form; subsequent calls deserialize the
+    cached bytes in a single parse instead of re-querying widget ids and
+    building the message field by field. (Widget ids are deterministic
+    across runs of the same script, so the cached ids stay valid for every
+    runner in this module.)
 
-        patched_call_callbacks.assert_not_called()
+    Parameters
+    ----------
+    scriptrunner : TestScriptRunner
+        A runner that has already produced widgets_script.py's deltas.
 
-        # Update widgets
+    """
+    global _updated_widget_states_blob
+    if _updated_widget_states_blob is None:
         states = WidgetStates()
         w1_id = scriptrunner.get_widget_id("checkbox", "checkbox")
         _create_widget(w1_id, states).bool_value = True
@@ -147,466 +152,487 @@ class ScriptRunnerTest(AsyncTestCase):
         _create_widget(w3_id, states).int_value = 2
         w4_id = scriptrunner.get_widget_id("button", "button")
         _create_widget(w4_id, states).trigger_value = True
+        _updated_widget_states_blob = states.SerializeToString()
+    return WidgetStates.FromString(_updated_widget_states_blob)
 
-        # Explicitly clear deltas before re-running, to prevent a race
-        # condition. (The ScriptRunner will clear the deltas when it
-        # starts the re-run, but if that doesn't happen before
-        # require_widgets_deltas() starts polling the ScriptRunner's deltas,
-        # it will see stale deltas from the last run.)
-        scriptrunner.clear_deltas()
-        scriptrunner.enqueue_rerun(widget_states=states)
-
-        require_widgets_deltas([scriptrunner])
-        self._assert_text_deltas(
-            scriptrunner, ["True", "matey!", "2", "True", "loop_forever"]
-        )
 
-        patched_call_callbacks.assert_called_once()
+def _assert_no_exceptions(scriptrunner):
+    """Asserts that no uncaught exceptions were thrown in the
+    scriptrunner's run thread.
 
-        scriptrunner.enqueue_shutdown()
-        scriptrunner.join()
+    Parameters
+    ----------
+    scriptrunner : TestScriptRunner
 
-    @patch("streamlit.exception")
-    @patch("streamlit.state.session_state.SessionState.call_callbacks")
-    def test_calls_widget_callbacks_error(
-        self, patched_call_callbacks, patched_st_exception
-    ):
-        patched_call_callbacks.side_effect = RuntimeError("Random Error")
-        scriptrunner = TestScriptRunner("widgets_script.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
+    """
+    assert [] == scriptrunner.script_thread_exceptions
 
-        # Default widget values
-        require_widgets_deltas([scriptrunner])
-        self._assert_text_deltas(
-            scriptrunner, ["False", "ahoy!", "0", "False", "loop_forever"]
-        )
 
-        patched_call_callbacks.assert_not_called()
+def _assert_events(scriptrunner, events):
+    """Asserts the ScriptRunnerEvents emitted by a TestScriptRunner are
+    what we expect.
 
-        # Update widgets
-        states = WidgetStates()
-        w1_id = scriptrunner.get_widget_id("checkbox", "checkbox")
-        _create_widget(w1_id, states).bool_value = True
-        w2_id = scriptrunner.get_widget_id("text_area", "text_area")
-        _create_widget(w2_id, states).string_value = "matey!"
-        w3_id = scriptrunner.get_widget_id("radio", "radio")
-        _create_widget(w3_id, states).int_value = 2
-        w4_id = scriptrunner.get_widget_id("button", "button")
-        _create_widget(w4_id, states).trigger_value = True
+    Parameters
+    ----------
+    scriptrunner : TestScriptRunner
+    events : list
 
-        # Explicitly clear deltas before re-running, to prevent a race
-        # condition. (The ScriptRunner will clear the deltas when it
-        # starts the re-run, but if that doesn't happen before
-        # require_widgets_deltas() starts polling the ScriptRunner's deltas,
-        # it will see stale deltas from the last run.)
-        scriptrunner.clear_deltas()
-        scriptrunner.enqueue_rerun(widget_states=states)
-
-        scriptrunner.join()
-
-        patched_call_callbacks.assert_called_once()
-
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                # We use the SCRIPT_STOPPED_WITH_SUCCESS event even if the
-                # script runs into an error during execution. The user is
-                # informed of the error by an `st.exception` box that we check
-                # for below.
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
+    """
+    assert events == scriptrunner.events
 
-        patched_st_exception.assert_called_once()
 
-    def test_missing_script(self):
-        """Tests that we get an exception event when a script doesn't exist."""
-        scriptrunner = TestScriptRunner("i_do_not_exist.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
-        self._assert_text_deltas(scriptrunner, [])
+def _assert_num_deltas(scriptrunner, num_deltas):
+    """Asserts that the given number of delta ForwardMsgs were enqueued
+    during script execution.
 
-    @parameterized.expand([(True,), (False,)])
-    def test_runtime_error(self, show_error_details: bool):
-        """Tests that we correctly handle scripts with runtime errors."""
-        with testutil.patch_config_options(
-            {"client.showErrorDetails": show_error_details}
-        ):
-            scriptrunner = TestScriptRunner("runtime_error.py")
-            scriptrunner.enqueue_rerun()
-            scriptrunner.start()
-            scriptrunner.join()
-
-            self._assert_no_exceptions(scriptrunner)
-            self._assert_events(
-                scriptrunner,
-                [
-                    ScriptRunnerEvent.SCRIPT_STARTED,
-                    ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                    ScriptRunnerEvent.SHUTDOWN,
-                ],
-            )
+    Parameters
+    ----------
+    scriptrunner : TestScriptRunner
+    num_deltas : int
 
-            # We'll get two deltas: one for st.text(), and one for the
-            # exception that gets thrown afterwards.
-            elts = scriptrunner.elements()
-            self._assert_num_deltas(scriptrunner, 2)
-            self.assertEqual(elts[0].WhichOneof("type"), "text")
+    """
+    assert num_deltas == len(scriptrunner.deltas())
 
-            if show_error_details:
-                self.assertEqual(elts[1].WhichOneof("type"), "exception")
-            else:
-                self.assertEqual(elts[1].WhichOneof("type"), "alert")
-                self.assertEqual(elts[1].alert.format, Alert.ERROR)
-                self.assertEqual(elts[1].alert.body, _GENERIC_UNCAUGHT_EXCEPTION_TEXT)
 
-    def test_stop_script(self):
-        """Tests that we can stop a script while it's running."""
-        scriptrunner = TestScriptRunner("infinite_loop.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
+def _assert_text_deltas(scriptrunner, text_deltas):
+    """Asserts that the scriptrunner's ReportQueue contains text deltas
+    with the given contents.
 
-        time.sleep(0.1)
-        scriptrunner.enqueue_rerun()
+    Parameters
+    ----------
+    scriptrunner : TestScriptRunner
+    text_deltas : List[str]
 
-        # This test will fail if the script runner does not execute the infinite
-        # script's write call at least once during the final script run.
-        # The script runs forever, and when we enqueue a rerun it forcibly
-        # stops execution and runs some cleanup. If we do not wait for the
-        # forced GC to finish, the script won't start running before we stop
-        # the script runner, so the expected delta is never created.
-        time.sleep(1)
-        scriptrunner.enqueue_stop()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
-        self._assert_text_deltas(scriptrunner, ["loop_forever"])
+    """
+    assert text_deltas == scriptrunner.text_deltas()
+
+
+def test_startup_shutdown():
+    """Test that we can create and shut down a ScriptRunner."""
+    scriptrunner = TestScriptRunner("good_script.py")
+    scriptrunner.run_inline()
+
+    _assert_no_exceptions(scriptrunner)
+    _assert_events(scriptrunner, [ScriptRunnerEvent.SHUTDOWN])
+    _assert_text_deltas(scriptrunner, [])
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected_events", "expected_text_deltas"),
+    [
+        ("good_script.py", _SUCCESS_EVENTS, [text_utf]),
+        # These files are .txt to avoid being broken by "make headers".
+        ("good_script_no_encoding.py.txt", _SUCCESS_EVENTS, [text_no_encoding]),
+        ("good_script_latin_encoding.py.txt", _SUCCESS_EVENTS, [text_latin]),
+        # A script that doesn't compile, and a script that doesn't exist,
+        # should both produce a compile-error event and no deltas.
+        ("compile_error.py.txt", _COMPILE_ERROR_EVENTS, []),
+        ("i_do_not_exist.py", _COMPILE_ERROR_EVENTS, []),
+    ],
+)
+def test_run_script(filename, expected_events, expected_text_deltas):
+    """Tests that we can run a script to completion, and that compile
+    errors and missing scripts are surfaced as exception events."""
+    scriptrunner = TestScriptRunner(filename)
+    scriptrunner.enqueue_rerun()
+    scriptrunner.run_inline()
+
+    _assert_no_exceptions(scriptrunner)
+    _assert_events(scriptrunner, expected_events)
+    _assert_text_deltas(scriptrunner, expected_text_deltas)
+
+    if ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS in expected_events:
+        # The following check is a requirement for the CodeHasher to
+        # work correctly. The CodeHasher is scoped to
+        # files contained in the directory of __main__.__file__, which we
+        # assume is the main script directory.
+        # (ScriptRunner should set the __main__.__file__ attribute
+        # correctly.)
+        assert scriptrunner._report.script_path == sys.modules["__main__"].__file__
 
-    def test_shutdown(self):
-        """Test that we can shutdown while a script is running."""
-        scriptrunner = TestScriptRunner("infinite_loop.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
-
-        time.sleep(0.1)
-        scriptrunner.enqueue_shutdown()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
-        self._assert_text_deltas(scriptrunner, ["loop_forever"])
 
-    def test_widgets(self):
-        """Tests that widget values behave as expected."""
-        scriptrunner = TestScriptRunner("widgets_script.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
+@patch("streamlit.state.session_state.SessionState.call_callbacks")
+def test_calls_widget_callbacks(patched_call_callbacks):
+    scriptrunner = TestScriptRunner("widgets_script.py")
+    scriptrunner.enqueue_rerun()
+    scriptrunner.start()
 
-        # Default widget values
-        require_widgets_deltas([scriptrunner])
-        self._assert_text_deltas(
-            scriptrunner, ["False", "ahoy!", "0", "False", "loop_forever"]
-        )
+    # Default widget values
+    require_widgets_deltas([scriptrunner])
+    _assert_text_deltas(scriptrunner, ["False", "ahoy!", "0", "False", "loop_forever"])
 
-        # Update widgets
-        states = WidgetStates()
-        w1_id = scriptrunner.get_widget_id("checkbox", "checkbox")
-        _create_widget(w1_id, states).bool_value = True
-        w2_id = scriptrunner.get_widget_id("text_area", "text_area")
-        _create_widget(w2_id, states).string_value = "matey!"
-        w3_id = scriptrunner.get_widget_id("radio", "radio")
-        _create_widget(w3_id, states).int_value = 2
-        w4_id = scriptrunner.get_widget_id("button", "button")
-        _create_widget(w4_id, states).trigger_value = True
+    patched_call_callbacks.assert_not_called()
 
-        # Explicitly clear deltas before re-running, to prevent a race
-        # condition. (The ScriptRunner will clear the deltas when it
-        # starts the re-run, but if that doesn't happen before
-        # require_widgets_deltas() starts polling the ScriptRunner's deltas,
-        # it will see stale deltas from the last run.)
-        scriptrunner.clear_deltas()
-        scriptrunner.enqueue_rerun(widget_states=states)
-
-        require_widgets_deltas([scriptrunner])
-        self._assert_text_deltas(
-            scriptrunner, ["True", "matey!", "2", "True", "loop_forever"]
-        )
+    # Update widgets
+    states = _get_updated_widget_states(scriptrunner)
 
-        # Rerun with previous values. Our button should be reset;
-        # everything else should be the same.
-        scriptrunner.clear_deltas()
-        scriptrunner.enqueue_rerun()
+    # Explicitly clear deltas before re-running, to prevent a race
+    # condition. (The ScriptRunner will clear the deltas when it
+    # starts the re-run, but if that doesn't happen before
+    # require_widgets_deltas() starts polling the ScriptRunner's deltas,
+    # it will see stale deltas from the last run.)
+    scriptrunner.clear_deltas()
+    scriptrunner.enqueue_rerun(widget_states=states)
 
-        require_widgets_deltas([scriptrunner])
-        self._assert_text_deltas(
-            scriptrunner, ["True", "matey!", "2", "False", "loop_forever"]
-        )
+    require_widgets_deltas([scriptrunner])
+    _assert_text_deltas(scriptrunner, ["True", "matey!", "2", "True", "loop_forever"])
 
-        scriptrunner.enqueue_shutdown()
-        scriptrunner.join()
-        self._assert_no_exceptions(scriptrunner)
+    patched_call_callbacks.assert_called_once()
 
-    def test_coalesce_rerun(self):
-        """Tests that multiple pending rerun requests get coalesced."""
-        scriptrunner = TestScriptRunner("good_script.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.enqueue_rerun()
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
-        scriptrunner.join()
-
-        self._assert_no_exceptions(scriptrunner)
-        self._assert_events(
-            scriptrunner,
-            [
-                ScriptRunnerEvent.SCRIPT_STARTED,
-                ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                ScriptRunnerEvent.SHUTDOWN,
-            ],
-        )
-        self._assert_text_deltas(scriptrunner, [text_utf])
+    scriptrunner.enqueue_shutdown()
+    scriptrunner.join()
 
-    def test_remove_nonexistent_elements(self):
-        """Tests that nonexistent elements are removed from widget cache after script run."""
 
-        widget_id = "nonexistent_widget_id"
+@patch("streamlit.exception")
+@patch("streamlit.state.session_state.SessionState.call_callbacks")
+def test_calls_widget_callbacks_error(patched_call_callbacks, patched_st_exception):
+    patched_call_callbacks.side_effect = RuntimeError("Random Error")
+    scriptrunner = TestScriptRunner("widgets_script.py")
+    scriptrunner.enqueue_rerun()
+    scriptrunner.start()
 
-        # Run script, sending in a WidgetStates containing our fake widget ID.
-        scriptrunner = TestScriptRunner("good_script.py")
-        states = WidgetStates()
-        _create_widget(widget_id, states).string_value = "streamlit"
-        scriptrunner.enqueue_rerun(widget_states=states)
-        scriptrunner.start()
-
-        # At this point, scriptrunner should have finished running, detected
-        # that our widget_id wasn't in the list of widgets found this run, and
-        # culled it. Ensure widget cache no longer holds our widget ID.
-        self.assertIsNone(scriptrunner._session_state.get(widget_id, None))
-
-    # TODO re-enable after flakyness is fixed
-    def off_test_multiple_scriptrunners(self):
-        """Tests that multiple scriptrunners can run simultaneously."""
-        # This scriptrunner will run before the other 3. It's used to retrieve
-        # the widget id before initializing deltas on other runners.
-        scriptrunner = TestScriptRunner("widgets_script.py")
-        scriptrunner.enqueue_rerun()
-        scriptrunner.start()
-
-        # Get the widget ID of a radio button and shut down the first runner.
-        require_widgets_deltas([scriptrunner])
-        radio_widget_id = scriptrunner.get_widget_id("radio", "radio")
-        scriptrunner.enqueue_shutdown()
-        scriptrunner.join()
-        self._assert_no_exceptions(scriptrunner)
-
-        # Build several runners. Each will set a different int value for
-        # its radio button.
-        runners = []
-        for ii in range(3):
-            runner = TestScriptRunner("widgets_script.py")
-            runners.append(runner)
-
-            states = WidgetStates()
-            _create_widget(radio_widget_id, states).int_value = ii
-            runner.enqueue_rerun(widget_state=states)
-
-        # Start the runners and wait a beat.
-        for runner in runners:
-            runner.start()
-
-        require_widgets_deltas(runners)
-
-        # Ensure that each runner's radio value is as expected.
-        for ii, runner in enumerate(runners):
-            self._assert_text_deltas(
-                runner, ["False", "ahoy!", "%s" % ii, "False", "loop_forever"]
-            )
-            runner.enqueue_shutdown()
-
-        time.sleep(0.1)
-
-        # Shut 'em all down!
-        for runner in runners:
-            runner.join()
-
-        for runner in runners:
-            self._assert_no_exceptions(runner)
-            self._assert_events(
-                runner,
-                [
-                    ScriptRunnerEvent.SCRIPT_STARTED,
-                    ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
-                    ScriptRunnerEvent.SHUTDOWN,
-                ],
-            )
+    # Default widget values
+    require_widgets_deltas([scriptrunner])
+    _assert_text_deltas(scriptrunner, ["False", "ahoy!", "0", "False", "loop_forever"])
 
-    def test_rerun_caching(self):
-        """Test that st.caches are maintained across script runs."""
-        # Make sure there are no caches from other tests.
-        caching._mem_caches.clear()
+    patched_call_callbacks.assert_not_called()
 
-        # Run st_cache_script.
-        runner = TestScriptRunner("st_cache_script.py")
-        runner.enqueue_rerun()
-        runner.start()
-        runner.join()
+    # Update widgets
+    states = _get_updated_widget_states(scriptrunner)
 
-        # The script has 5 cached functions, each of which writes out
-        # some text.
-        self._assert_text_deltas(
-            runner,
-            [
-                "cached function called",
-                "cached function called",
-                "cached function called",
-                "cached function called",
-                "cached_depending_on_not_yet_defined called",
-            ],
-        )
+    # Explicitly clear deltas before re-running, to prevent a race
+    # condition. (The ScriptRunner will clear the deltas when it
+    # starts the re-run, but if that doesn't happen before
+    # require_widgets_deltas() starts polling the ScriptRunner's deltas,
+    # it will see stale deltas from the last run.)
+    scriptrunner.clear_deltas()
+    scriptrunner.enqueue_rerun(widget_states=states)
 
-        # Re-run the script on a second runner.
-        runner = TestScriptRunner("st_cache_script.py")
-        runner.enqueue_rerun()
-        runner.start()
-        runner.join()
+    scriptrunner.join()
 
-        # The cached functions should not have been called on this second run
-        self._assert_text_deltas(runner, [])
+    patched_call_callbacks.assert_called_once()
 
-    def test_invalidating_cache(self):
-        """Test that st.caches are cleared when a dependency changes."""
-        # Make sure there are no caches from other tests.
-        caching._mem_caches.clear()
+    _assert_events(
+        scriptrunner,
+        [
+            ScriptRunnerEvent.SCRIPT_STARTED,
+            ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+            ScriptRunnerEvent.SCRIPT_STARTED,
+            # We use the SCRIPT_STOPPED_WITH_SUCCESS event even if the
+            # script runs into an error during execution. The user is
+            # informed of the error by an `st.exception` box that we check
+            # for below.
+            ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+            ScriptRunnerEvent.SHUTDOWN,
+        ],
+    )
 
-        # Run st_cache_script.
-        runner = TestScriptRunner("st_cache_script.py")
-        runner.enqueue_rerun()
-        runner.start()
-        runner.join()
+    patched_st_exception.assert_called_once()
 
-        # The script has 5 cached functions, each of which writes out
-        # som text.
-        self._assert_text_deltas(
-            runner,
-            [
-                "cached function called",
-                "cached function called",
-                "cached function called",
-                "cached function called",
-                "cached_depending_on_not_yet_defined called",
-            ],
-        )
 
-        # Run a slightly different script on a second runner.
-        runner = TestScriptRunner("st_cache_script_changed.py")
-        runner.enqueue_rerun()
-        runner.start()
+@pytest.mark.parametrize("show_error_details", [True, False])
+def test_runtime_error(show_error_details: bool):
+    """Tests that we correctly handle scripts with runtime errors."""
+    with testutil.patch_config_options(
+        {"client.showErrorDetails": show_error_details}
+    ):
+        scriptrunner = TestScriptRunner("runtime_error.py")
+        scriptrunner.enqueue_rerun()
+        scriptrunner.run_inline()
+
+        _assert_no_exceptions(scriptrunner)
+        _assert_events(scriptrunner, _SUCCESS_EVENTS)
+
+        # We'll get two deltas: one for st.text(), and one for the
+        # exception that gets thrown afterwards.
+        elts = scriptrunner.elements()
+        _assert_num_deltas(scriptrunner, 2)
+        assert elts[0].WhichOneof("type") == "text"
+
+        if show_error_details:
+            assert elts[1].WhichOneof("type") == "exception"
+        else:
+            assert elts[1].WhichOneof("type") == "alert"
+            assert elts[1].alert.format == Alert.ERROR
+            assert elts[1].alert.body == _GENERIC_UNCAUGHT_EXCEPTION_TEXT
+
+
+def test_stop_script():
+    """Tests that we can stop a script while it's running."""
+    scriptrunner = TestScriptRunner("gated_loop.py")
+    scriptrunner.enqueue_rerun()
+    scriptrunner.start()
+
+    # Wait until the script is running and has enqueued its first delta
+    # before interrupting it with a rerun.
+    scriptrunner.wait_for_event(ScriptRunnerEvent.SCRIPT_STARTED)
+    scriptrunner.wait_for_deltas(1)
+    scriptrunner.enqueue_rerun()
+
+    # This test will fail if the script runner does not execute the infinite
+    # script's write call at least once during the final script run.
+    # The runner clears its deltas when the rerun starts, so wait for the
+    # second SCRIPT_STARTED event and then for the rerun's first delta
+    # before stopping the script runner.
+    scriptrunner.wait_for_event(ScriptRunnerEvent.SCRIPT_STARTED, count=2)
+    scriptrunner.wait_for_deltas(1)
+    scriptrunner.enqueue_stop()
+    scriptrunner.join()
+
+    _assert_no_exceptions(scriptrunner)
+    _assert_events(
+        scriptrunner,
+        [
+            ScriptRunnerEvent.SCRIPT_STARTED,
+            ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+            ScriptRunnerEvent.SCRIPT_STARTED,
+            ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS,
+            ScriptRunnerEvent.SHUTDOWN,
+        ],
+    )
+    _assert_text_deltas(scriptrunner, ["loop_forever"])
+
+
+def test_shutdown():
+    """Test that we can shutdown while a script is running."""
+    scriptrunner = TestScriptRunner("gated_loop.py")
+    scriptrunner.enqueue_rerun()
+    scriptrunner.start()
+
+    # Wait until the script is running and has enqueued its first delta
+    # before shutting it down.
+    scriptrunner.wait_for_event(ScriptRunnerEvent.SCRIPT_STARTED)
+    scriptrunner.wait_for_deltas(1)
+    scriptrunner.enqueue_shutdown()
+    scriptrunner.join()
+
+    _assert_no_exceptions(scriptrunner)
+    _assert_events(scriptrunner, _SUCCESS_EVENTS)
+    _assert_text_deltas(scriptrunner, ["loop_forever"])
+
+
+def test_widgets():
+    """Tests that widget values behave as expected."""
+    scriptrunner = TestScriptRunner("widgets_script.py")
+    scriptrunner.enqueue_rerun()
+    scriptrunner.start()
+
+    # Default widget values
+    require_widgets_deltas([scriptrunner])
+    _assert_text_deltas(scriptrunner, ["False", "ahoy!", "0", "False", "loop_forever"])
+
+    # Update widgets
+    states = _get_updated_widget_states(scriptrunner)
+
+    # Explicitly clear deltas before re-running, to prevent a race
+    # condition. (The ScriptRunner will clear the deltas when it
+    # starts the re-run, but if that doesn't happen before
+    # require_widgets_deltas() starts polling the ScriptRunner's deltas,
+    # it will see stale deltas from the last run.)
+    scriptrunner.clear_deltas()
+    scriptrunner.enqueue_rerun(widget_states=states)
+
+    require_widgets_deltas([scriptrunner])
+    _assert_text_deltas(scriptrunner, ["True", "matey!", "2", "True", "loop_forever"])
+
+    # Rerun with previous values. Our button should be reset;
+    # everything else should be the same.
+    scriptrunner.clear_deltas()
+    scriptrunner.enqueue_rerun()
+
+    require_widgets_deltas([scriptrunner])
+    _assert_text_deltas(scriptrunner, ["True", "matey!", "2", "False", "loop_forever"])
+
+    scriptrunner.enqueue_shutdown()
+    scriptrunner.join()
+    _assert_no_exceptions(scriptrunner)
+
+
+def test_coalesce_rerun():
+    """Tests that multiple pending rerun requests get coalesced."""
+    scriptrunner = TestScriptRunner("good_script.py")
+    scriptrunner.enqueue_reruns(3)
+    scriptrunner.run_inline()
+
+    _assert_no_exceptions(scriptrunner)
+    _assert_events(scriptrunner, _SUCCESS_EVENTS)
+    _assert_text_deltas(scriptrunner, [text_utf])
+
+
+def test_remove_nonexistent_elements():
+    """Tests that nonexistent elements are removed from widget cache after script run."""
+
+    widget_id = "nonexistent_widget_id"
+
+    # Run script, sending in a WidgetStates containing our fake widget ID.
+    scriptrunner = TestScriptRunner("good_script.py")
+    states = WidgetStates()
+    _create_widget(widget_id, states).string_value = "streamlit"
+    scriptrunner.enqueue_rerun(widget_states=states)
+    scriptrunner.run_inline()
+
+    # At this point, scriptrunner has finished running, detected that
+    # our widget_id wasn't in the list of widgets found this run, and
+    # culled it. Ensure widget cache no longer holds our widget ID.
+    assert scriptrunner._session_state.get(widget_id, None) is None
+
+
+@pytest.mark.skip(reason="TODO re-enable after flakyness is fixed")
+def test_multiple_scriptrunners(executor):
+    """Tests that multiple scriptrunners can run simultaneously."""
+    # This scriptrunner will run before the other 3. It's used to retrieve
+    # the widget id before initializing deltas on other runners.
+    scriptrunner = TestScriptRunner("widgets_script.py")
+    scriptrunner.enqueue_rerun()
+    scriptrunner.start()
+
+    # Get the widget ID of a radio button and shut down the first runner.
+    require_widgets_deltas([scriptrunner])
+    radio_widget_id = scriptrunner.get_widget_id("radio", "radio")
+    scriptrunner.enqueue_shutdown()
+    scriptrunner.join()
+    _assert_no_exceptions(scriptrunner)
+
+    # Build several runners. Each will set a different int value for
+    # its radio button.
+    runners = []
+    for ii in range(3):
+        runner = TestScriptRunner("widgets_script.py")
+        runners.append(runner)
+
+        states = WidgetStates()
+        _create_widget(radio_widget_id, states).int_value = ii
+        runner.enqueue_rerun(widget_states=states)
+
+    # Start the runners on the shared thread pool and wait a beat.
+    for runner in runners:
+        runner.start(executor=executor)
+
+    require_widgets_deltas(runners)
+
+    # Ensure that each runner's radio value is as expected, comparing
+    # all runners in a single assert.
+    assert [
+        ["False", "ahoy!", "%s" % ii, "False", "loop_forever"]
+        for ii in range(len(runners))
+    ] == [runner.text_deltas() for runner in runners]
+
+    # Shut 'em all down!
+    for runner in runners:
+        runner.enqueue_shutdown()
+    for runner in runners:
         runner.join()
 
-        # The cached functions should not have been called on this second run,
-        # except for the one that has actually changed.
-        self._assert_text_deltas(
-            runner,
-            [
-                "cached_depending_on_not_yet_defined called",
-            ],
-        )
+    assert [[]] * len(runners) == [
+        runner.script_thread_exceptions for runner in runners
+    ]
+    assert [_SUCCESS_EVENTS] * len(runners) == [runner.events for runner in runners]
 
-    def _assert_no_exceptions(self, scriptrunner):
-        """Asserts that no uncaught exceptions were thrown in the
-        scriptrunner's run thread.
 
-        Parameters
-        ----------
-        scriptrunner : TestScriptRunner
+def test_rerun_caching():
+    """Test that st.caches are maintained across script runs."""
+    # Make sure there are no caches from other tests.
+    caching._mem_caches.clear()
 
-        """
-        self.assertEqual([], scriptrunner.script_thread_exceptions)
+    # Run st_cache_script.
+    runner = TestScriptRunner("st_cache_script.py")
+    runner.enqueue_rerun()
+    runner.run_inline()
 
-    def _assert_events(self, scriptrunner, events):
-        """Asserts the ScriptRunnerEvents emitted by a TestScriptRunner are
-        what we expect.
+    # The script has 5 cached functions, each of which writes out
+    # some text.
+    _assert_text_deltas(
+        runner,
+        [
+            "cached function called",
+            "cached function called",
+            "cached function called",
+            "cached function called",
+            "cached_depending_on_not_yet_defined called",
+        ],
+    )
 
-        Parameters
-        ----------
-        scriptrunner : TestScriptRunner
-        events : list
+    # Re-run the script on a second runner.
+    runner = TestScriptRunner("st_cache_script.py")
+    runner.enqueue_rerun()
+    runner.run_inline()
 
-        """
-        self.assertEqual(events, scriptrunner.events)
+    # The cached functions should not have been called on this second run
+    _assert_text_deltas(runner, [])
 
-    def _assert_num_deltas(self, scriptrunner, num_deltas):
-        """Asserts that the given number of delta ForwardMsgs were enqueued
-        during script execution.
 
-        Parameters
-        ----------
-        scriptrunner : TestScriptRunner
-        num_deltas : int
+def test_invalidating_cache():
+    """Test that st.caches are cleared when a dependency changes."""
+    # Make sure there are no caches from other tests.
+    caching._mem_caches.clear()
 
-        """
-        self.assertEqual(num_deltas, len(scriptrunner.deltas()))
+    # Run st_cache_script.
+    runner = TestScriptRunner("st_cache_script.py")
+    runner.enqueue_rerun()
+    runner.run_inline()
 
-    def _assert_text_deltas(self, scriptrunner, text_deltas):
-        """Asserts that the scriptrunner's ReportQueue contains text deltas
-        with the given contents.
+    # The script has 5 cached functions, each of which writes out
+    # som text.
+    _assert_text_deltas(
+        runner,
+        [
+            "cached function called",
+            "cached function called",
+            "cached function called",
+            "cached function called",
+            "cached_depending_on_not_yet_defined called",
+        ],
+    )
 
-        Parameters
-        ----------
-        scriptrunner : TestScriptRunner
-        text_deltas : List[str]
+    # Run a slightly different script on a second runner.
+    runner = TestScriptRunner("st_cache_script_changed.py")
+    runner.enqueue_rerun()
+    runner.run_inline()
 
-        """
-        self.assertEqual(text_deltas, scriptrunner.text_deltas())
+    # The cached functions should not have been called on this second run,
+    # except for the one that has actually changed.
+    _assert_text_deltas(
+        runner,
+        [
+            "cached_depending_on_not_yet_defined called",
+        ],
+    )
 
 
 class TestScriptRunner(ScriptRunner):
     """Subclasses ScriptRunner to provide some testing features."""
 
+    # Tell pytest this class isn't a collection of tests, despite the name.
+    __test__ = False
+
     def __init__(self, script_name):
         """Initializes the ScriptRunner for the given script_name"""
         # DeltaGenerator deltas will be enqueued into self.report_queue.
         self.report_queue = ReportQueue()
 
+        # A parallel record of the delta messages in self.report_queue,
+        # maintained at enqueue time so that deltas() doesn't have to rescan
+        # the queue (and re-run protobuf reflection on every message) each
+        # time it's called. Deltas are coalesced by delta_path, mirroring
+        # ReportQueue.enqueue.
+        self._delta_lock = threading.Lock()
+        self._delta_msgs: List[Delta] = []
+        self._delta_index_by_path = {}
+        # The text body of each recorded delta, or None for deltas that
+        # aren't text elements. Kept in lockstep with _delta_msgs so that
+        # text_deltas() needs no protobuf reflection at all.
+        self._delta_text_bodies: List[str] = []
+
         def enqueue_fn(msg):
             self.report_queue.enqueue(msg)
+            if msg.HasField("delta"):
+                self._record_delta(msg)
+            with self._event_cond:
+                self._event_cond.notify_all()
             self.maybe_handle_execution_control_request()
 
         self.script_request_queue = ScriptRequestQueue()
-        script_path = os.path.join(os.path.dirname(__file__), "test_data", script_name)
+        script_path = os.path.join(_TEST_DATA_DIR, script_name)
 
         super(TestScriptRunner, self).__init__(
             session_id="test session id",
@@ -618,49 +644,132 @@ class TestScriptRunner(ScriptRunner):
         )
 
         # Accumulates uncaught exceptions thrown by our run thread.
+        # (Appended to by the forward_script_thread_exceptions fixture's
+        # threading.excepthook forwarder.)
         self.script_thread_exceptions = []
 
         # Accumulates all ScriptRunnerEvents emitted by us.
         self.events = []
 
+        # Notified whenever an event is recorded or a ForwardMsg is enqueued,
+        # so that tests can block until the runner reaches a given state
+        # instead of sleeping for a fixed amount of time.
+        self._event_cond = threading.Condition()
+        self._event_counts: Counter = Counter()
+
         def record_event(event, **kwargs):
-            self.events.append(event)
+            with self._event_cond:
+                self.events.append(event)
+                self._event_counts[event] += 1
+                self._event_cond.notify_all()
+
+        # Keep a reference to the listener so close() can disconnect it.
+        self._record_event = record_event
+        self.on_event.connect(self._record_event, weak=False)
+
+        _live_runners.append(self)
+
+    def close(self):
+        """Disconnect our event listener and release our queued messages.
+
+        Called from the cleanup_runners fixture, after the run thread has
+        exited. Safe to call more than once.
+        """
+        self.on_event.disconnect(self._record_event)
+        self.clear_deltas()
+        if self in _live_runners:
+            _live_runners.remove(self)
 
-        self.on_event.connect(record_event, weak=False)
+    def wait_for_event(self, event, count=1, timeout=5):
+        """Block until we've emitted the given ScriptRunnerEvent at least
+        `count` times.
+
+        Returns True if the event count was reached, or False if the timeout
+        expired first.
+        """
+        with self._event_cond:
+            return self._event_cond.wait_for(
+                lambda: self._event_counts[event] >= count, timeout=timeout
+            )
+
+    def wait_for_deltas(self, count=1, timeout=5):
+        """Block until our ReportQueue contains at least `count` delta
+        messages.
+
+        Returns True if the delta count was reached, or False if the timeout
+        expired first.
+        """
+        with self._event_cond:
+            return self._event_cond.wait_for(
+                lambda: len(self.deltas()) >= count, timeout=timeout
+            )
 
     def enqueue_rerun(self, argv=None, widget_states=None):
         self.script_request_queue.enqueue(
             ScriptRequest.RERUN, RerunData(widget_states=widget_states)
         )
 
+    def enqueue_reruns(self, count):
+        """Enqueue `count` rerun requests in a single batch."""
+        self.script_request_queue.enqueue_many(
+            [(ScriptRequest.RERUN, RerunData(widget_states=None))] * count
+        )
+
     def enqueue_stop(self):
         self.script_request_queue.enqueue(ScriptRequest.STOP)
 
     def enqueue_shutdown(self):
         self.script_request_queue.enqueue(ScriptRequest.SHUTDOWN)
 
-    def _process_request_queue(self):
-        try:
-            super(TestScriptRunner, self)._process_request_queue()
-        except BaseException as e:
-            self.script_thread_exceptions.append(e)
+    def _record_delta(self, msg):
+        """Record an enqueued delta message in our parallel delta list.
+
+        Called from the script thread, inside enqueue_fn.
+        """
+        text_body = None
+        if (
+            msg.delta.WhichOneof("type") == "new_element"
+            and msg.delta.new_element.WhichOneof("type") == "text"
+        ):
+            text_body = msg.delta.new_element.text.body
+
+        with self._delta_lock:
+            delta_key = tuple(msg.metadata.delta_path)
+            index = self._delta_index_by_path.get(delta_key)
+            if index is not None and not msg.delta.HasField("arrow_add_rows"):
+                # Replace the previous delta at this path, the same way
+                # ReportQueue combines deltas. (None of our test scripts use
+                # add_rows, so replacement is equivalent to composition here.)
+                self._delta_msgs[index] = msg.delta
+                self._delta_text_bodies[index] = text_body
+            else:
+                self._delta_index_by_path[delta_key] = len(self._delta_msgs)
+                self._delta_msgs.append(msg.delta)
+                self._delta_text_bodies.append(text_body)
 
     def _run_script(self, rerun_data):
-        self.report_queue.clear()
+        self.clear_deltas()
         super(TestScriptRunner, self)._run_script(rerun_data)
 
     def join(self):
-        """Joins the run thread, if it was started"""
-        if self._script_thread is not None:
+        """Joins the run thread or executor Future, if we were started"""
+        if self._script_future is not None:
+            self._script_future.result()
+        elif self._script_thread is not None:
             self._script_thread.join()
 
     def clear_deltas(self):
         """Clear all delta messages from our ReportQueue"""
-        self.report_queue.clear()
+        with self._delta_lock:
+            self.report_queue.clear()
+            self._delta_msgs = []
+            self._delta_index_by_path = {}
+            self._delta_text_bodies = []
 
     def deltas(self) -> List[Delta]:
         """Return the delta messages in our ReportQueue"""
-        return [msg.delta for msg in self.report_queue._queue if msg.HasField("delta")]
+        with self._delta_lock:
+            return list(self._delta_msgs)
 
     def elements(self) -> List[Element]:
         """Return the delta.new_element messages in our ReportQueue."""
@@ -668,11 +777,8 @@ class TestScriptRunner(ScriptRunner):
 
     def text_deltas(self) -> List[str]:
         """Return the string contents of text deltas in our ReportQueue"""
-        return [
-            element.text.body
-            for element in self.elements()
-            if element.WhichOneof("type") == "text"
-        ]
+        with self._delta_lock:
+            return [body for body in self._delta_text_bodies if body is not None]
 
     def get_widget_id(self, widget_type, label):
         """Returns the id of the widget with the specified type and label"""
@@ -698,13 +804,14 @@ def require_widgets_deltas(
 
     t0 = time.time()
     num_complete = 0
-    while time.time() - t0 < timeout:
-        time.sleep(0.1)
-        num_complete = sum(
-            1 for runner in runners if len(runner.deltas()) >= NUM_DELTAS
-        )
-        if num_complete == len(runners):
-            return
+    for runner in runners:
+        remaining = max(0.0, timeout - (time.time() - t0))
+        if not runner.wait_for_deltas(NUM_DELTAS, timeout=remaining):
+            break
+        num_complete += 1
+
+    if num_complete == len(runners):
+        return
 
     # If we get here, at least 1 runner hasn't yet completed before our
     # timeout. Create an error string for debugging.
@@ -12,12 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""A script for ScriptRunnerTest that never ends"""
+"""A script for ScriptRunnerTest that loops until its gate is set.
+
+Like infinite_loop.py, but instead of sleeping between iterations it waits
+on ScriptRunnerTest's shared loop_gate Event, so the test can release the
+loop immediately rather than waiting out a sleep.
+"""
 
-import time
 import streamlit as st
 
+from tests.streamlit.scriptrunner.loop_gate import loop_gate
+
 element = st.empty()
-while True:
+while not loop_gate.is_set():
     element.text("loop_forever")
-    time.sleep(0.01)
+    loop_gate.wait(0.01)
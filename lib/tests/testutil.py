@@ -106,7 +106,7 @@ class DeltaGeneratorTestCase(unittest.TestCase):
         -------
         ForwardMsg
         """
-        return self.report_queue._queue[index]
+        return self.report_queue.snapshot()[index]
 
     def get_delta_from_queue(self, index=-1):
         """Get a Delta proto from the queue, by index.
@@ -120,7 +120,9 @@ class DeltaGeneratorTestCase(unittest.TestCase):
 
     def get_all_deltas_from_queue(self):
         """Return all the delta messages in our ReportQueue"""
-        return [msg.delta for msg in self.report_queue._queue if msg.HasField("delta")]
+        return [
+            msg.delta for msg in self.report_queue.snapshot() if msg.HasField("delta")
+        ]
 
     def clear_queue(self):
         self.report_queue._clear()